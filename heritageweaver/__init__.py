@@ -0,0 +1,2 @@
+from .collections import BTCollection, NMSCollection, SMGCollection
+from .vectorise import MultiModalCollection
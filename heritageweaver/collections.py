@@ -0,0 +1,271 @@
+"""Loaders and image fetchers for the source collections.
+
+One class per partner collection: the Science Museum Group
+(Elasticsearch JSON dump), the BT Archives (DScribe XML export) and
+National Museums Scotland (Adlib CSV exports). Each class knows how to
+load its catalogue into a dataframe and how to fetch the images it
+references.
+"""
+
+import asyncio
+import os
+from pathlib import Path
+
+import aiohttp
+import orjson
+import pandas as pd
+import polars as pl
+from lxml import etree
+from tqdm import tqdm
+
+from .vectorise import MultiModalCollection
+
+MAX_WORKERS = 32
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.3
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+SMG_IMG_URL = 'https://coimages.sciencemuseumgroup.org.uk/'
+BT_IMG_URL = 'https://btarchives.sciencemuseumgroup.org.uk/thumbnails/'
+NMS_IMG_URL = 'https://media.nms.ac.uk/collections/'
+
+
+def existing_images(img_folder):
+    """Names of the files already in an image folder, from one scan."""
+    return {entry.name for entry in os.scandir(img_folder) if entry.is_file()}
+
+
+async def fetch_image(session, semaphore, url, out_path):
+    """Download one image; return its name if it is now on disk.
+
+    Transient client errors, resets and timeouts are retried with
+    exponential backoff; an image that still fails returns None
+    instead of aborting the whole crawl.
+    """
+    if out_path.is_file():
+        return out_path.name
+    async with semaphore:
+        for attempt in range(FETCH_RETRIES):
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        out_path.write_bytes(await response.read())
+                        return out_path.name
+                    if response.status < 500:
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(FETCH_BACKOFF * 2 ** attempt)
+    return None
+
+
+async def _fetch_many(pairs, img_folder, limit):
+    semaphore = asyncio.Semaphore(limit)
+    connector = aiohttp.TCPConnector(limit=limit * 2)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=FETCH_TIMEOUT
+    ) as session:
+        tasks = [
+            fetch_image(session, semaphore, url, img_folder / img_name)
+            for url, img_name in pairs
+        ]
+        return [
+            await task
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks))
+        ]
+
+
+def fetch_all(pairs, img_folder, max_workers=MAX_WORKERS):
+    """Download (url, img_name) pairs concurrently with aiohttp.
+
+    One event loop multiplexes all the downloads over a pooled
+    connector, with a semaphore bounding in-flight requests so the
+    image servers are not hammered. Returns the names of the images
+    that are on disk after the run.
+    """
+    img_folder.mkdir(parents=True, exist_ok=True)
+    results = asyncio.run(_fetch_many(list(pairs), img_folder, max_workers))
+    return {name for name in results if name}
+
+
+class SMGCollection(MultiModalCollection):
+    """Science Museum Group catalogue loaded from an ES JSON dump."""
+
+    collection_name = 'smg'
+    columns = ['record_id', 'description', 'names', 'taxonomy',
+               'img_loc', 'img_name', 'img_path', 'downloaded']
+
+    def __init__(self, img_folder='smg_images', db_path='db'):
+        super().__init__(db_path=db_path)
+        self.img_folder = Path(img_folder)
+        self.img_folder.mkdir(parents=True, exist_ok=True)
+        # Image names (not Path objects) already on disk; kept up to
+        # date incrementally by fetch_images.
+        self.images = existing_images(self.img_folder)
+
+    def load_from_json(self, json_path):
+        """Load catalogue records from a line-delimited JSON dump."""
+        with open(json_path, 'rb') as in_json:
+            lines = in_json.read().splitlines()
+        self.df = pd.DataFrame.from_records(
+            (self.process_json_record(orjson.loads(line))
+             for line in tqdm(lines)),
+            columns=self.columns,
+        )
+
+    def process_json_record(self, record):
+        """Flatten one Elasticsearch record into a row dict."""
+        source = record['_source']
+        record_id = record['_id']
+        description = source.get('description', [{}])[0].get('value', '')
+        description = ' '.join(description.split())
+        names_raw = '; '.join(
+            name.get('value', '').strip() for name in source.get('name', [])
+        )
+        names = ' '.join(names_raw.split())
+        terms = source.get('terms', [])
+        hierarchy = terms[0].get('hierarchy', []) if terms else []
+        taxonomy = '; '.join(
+            value.strip() for _, value in sorted(
+                (term['sort'], term['name'][0]['value']) for term in hierarchy
+            )
+        )
+        multimedia = source.get('multimedia', [])
+        img_loc = ''
+        if multimedia:
+            img_loc = multimedia[0]['processed']['large_thumbnail']['location']
+        img_name = img_loc.split('/')[-1]
+        img_path = str(self.img_folder / img_name) if img_name else ''
+        downloaded = img_name in self.images
+        return {
+            'record_id': record_id,
+            'description': description,
+            'names': names,
+            'taxonomy': taxonomy,
+            'img_loc': img_loc,
+            'img_name': img_name,
+            'img_path': img_path,
+            'downloaded': downloaded,
+        }
+
+    def fetch_images(self, base_url=SMG_IMG_URL):
+        """Download the thumbnails referenced by the catalogue."""
+        to_fetch = self.df[~self.df['downloaded'] & (self.df['img_loc'] != '')]
+        pairs = list(zip(base_url + to_fetch['img_loc'], to_fetch['img_name']))
+        self.images |= fetch_all(pairs, self.img_folder)
+        self.df['downloaded'] = self.df['img_name'].isin(self.images)
+
+
+class BTCollection(MultiModalCollection):
+    """BT Archives catalogue loaded from a DScribe XML export."""
+
+    collection_name = 'bt'
+    columns = ['RefNo', 'Title', 'Description', 'Thumbnail']
+
+    def __init__(self, img_folder='bt_images', db_path='db'):
+        super().__init__(db_path=db_path)
+        self.img_folder = Path(img_folder)
+        self.img_folder.mkdir(parents=True, exist_ok=True)
+
+    def load_from_xml(self, xml_path):
+        """Load catalogue records from the DScribe XML export.
+
+        The export is streamed with ``iterparse`` and processed
+        elements are freed as soon as their row is extracted, so memory
+        stays flat instead of holding the whole DOM.
+        """
+        rows = []
+        context = etree.iterparse(
+            str(xml_path), tag='DScribeRecord', events=('end',)
+        )
+        for _, record in tqdm(context):
+            rows.append([record.findtext(c, '') for c in self.columns])
+            record.clear()
+            while record.getprevious() is not None:
+                del record.getparent()[0]
+        self.df = pd.DataFrame.from_records(rows, columns=self.columns)
+        self.df['img_name'] = self.df['Thumbnail'].apply(
+            lambda x: x.split('\\')[-1]
+        )
+        self.df['img_path'] = self.df['img_name'].apply(
+            lambda x: str(self.img_folder / x) if x else ''
+        )
+        # One directory scan instead of a stat call per row.
+        self.df['downloaded'] = self.df['img_name'].isin(
+            existing_images(self.img_folder)
+        )
+        self.df = self.df.rename(
+            columns={'RefNo': 'record_id', 'Description': 'description'}
+        )
+
+    def fetch_images(self, base_url=BT_IMG_URL):
+        """Download the thumbnails referenced by the catalogue."""
+        to_fetch = self.df[~self.df['downloaded'] & (self.df['img_name'] != '')]
+        pairs = list(zip(base_url + to_fetch['img_name'], to_fetch['img_name']))
+        fetched = fetch_all(pairs, self.img_folder)
+        self.df['downloaded'] |= self.df['img_name'].isin(fetched)
+
+
+class NMSCollection(MultiModalCollection):
+    """National Museums Scotland catalogue loaded from Adlib CSVs."""
+
+    collection_name = 'nms'
+
+    def __init__(self, img_folder='nms_images', db_path='db'):
+        super().__init__(db_path=db_path)
+        self.img_folder = Path(img_folder)
+        self.img_folder.mkdir(parents=True, exist_ok=True)
+
+    def load_original_csvs(self, csv_folder):
+        """Load and merge the per-department Adlib CSV exports.
+
+        The exports are read and reshaped with polars (multithreaded
+        CSV parsing, expression-level string ops on Arrow memory) and
+        only converted to pandas at the end for the rest of the
+        pipeline.
+        """
+        files = sorted(Path(csv_folder).glob('*.csv'))
+        dfs = [pl.read_csv(f, infer_schema_length=0) for f in files]
+        common = set(dfs[0].columns)
+        for df in dfs[1:]:
+            common &= set(df.columns)
+        common = [c for c in dfs[0].columns if c in common]
+        has_img = pl.col('img_loc').fill_null('') != ''
+        df = (
+            pl.concat([df.select(common) for df in dfs], how='vertical')
+            .unique(subset=['priref'], keep='first', maintain_order=True)
+            .with_columns(
+                pl.col('reproduction.reference')
+                .fill_null('')
+                .str.split('|')
+                .alias('img_loc')
+            )
+            .explode('img_loc')
+            .with_columns(
+                pl.when(has_img)
+                .then(pl.col('img_loc') + '.jpg')
+                .otherwise(pl.lit(''))
+                .alias('img_name')
+            )
+            .with_columns(
+                pl.when(has_img)
+                .then(pl.lit(str(self.img_folder) + os.sep)
+                      + pl.col('img_name'))
+                .otherwise(pl.lit(''))
+                .alias('img_path')
+            )
+            .with_columns(
+                pl.col('img_name')
+                .is_in(list(existing_images(self.img_folder)))
+                .alias('downloaded')
+            )
+            .rename({'priref': 'record_id'})
+        )
+        self.df = df.to_pandas()
+
+    def fetch_images(self, base_url=NMS_IMG_URL):
+        """Download the images referenced by the catalogue."""
+        to_fetch = self.df[~self.df['downloaded'] & (self.df['img_name'] != '')]
+        pairs = list(zip(base_url + to_fetch['img_loc'], to_fetch['img_name']))
+        fetched = fetch_all(pairs, self.img_folder)
+        self.df['downloaded'] |= self.df['img_name'].isin(fetched)
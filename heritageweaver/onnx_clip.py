@@ -0,0 +1,134 @@
+"""Optional ONNX Runtime backend for the CLIP encoder.
+
+Exports the text and vision towers of the sentence-transformers CLIP
+checkpoint to ONNX once, then serves embeddings through onnxruntime —
+noticeably faster than eager PyTorch on CPU and still producing the
+same vectors for downstream cosine search. Enabled with
+``MultiModalCollection.load_clip_model(use_onnx=True)``.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+import torch
+from tqdm import tqdm
+
+OPSET_VERSION = 17
+PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+
+
+class _TextTower(torch.nn.Module):
+    """Expose ``get_text_features`` as a plain forward for export."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(
+            input_ids=input_ids, attention_mask=attention_mask
+        )
+
+
+class _VisionTower(torch.nn.Module):
+    """Expose ``get_image_features`` as a plain forward for export."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class OnnxClipEncoder:
+    """Batched CLIP encoder backed by onnxruntime sessions.
+
+    Mirrors the subset of the sentence-transformers ``encode``
+    signature used by the vectorisation pipeline; tokenization and
+    image preprocessing stay in Python.
+    """
+
+    def __init__(self, clip_model, export_dir='onnx'):
+        clip = clip_model._first_module()
+        self.tokenizer = clip.processor.tokenizer
+        self.image_processor = clip.processor.image_processor
+        export_dir = Path(export_dir)
+        export_dir.mkdir(parents=True, exist_ok=True)
+        text_path = export_dir / 'clip_text.onnx'
+        vision_path = export_dir / 'clip_vision.onnx'
+        if not (text_path.is_file() and vision_path.is_file()):
+            self._export(clip.model, text_path, vision_path)
+        self.text_session = ort.InferenceSession(
+            str(text_path), providers=PROVIDERS
+        )
+        self.vision_session = ort.InferenceSession(
+            str(vision_path), providers=PROVIDERS
+        )
+
+    def _export(self, model, text_path, vision_path):
+        model = model.to('cpu').float().eval()
+        dummy_ids = torch.ones((1, 8), dtype=torch.long)
+        dummy_mask = torch.ones((1, 8), dtype=torch.long)
+        torch.onnx.export(
+            _TextTower(model),
+            (dummy_ids, dummy_mask),
+            str(text_path),
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['text_embeds'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'seq'},
+                'attention_mask': {0: 'batch', 1: 'seq'},
+                'text_embeds': {0: 'batch'},
+            },
+            opset_version=OPSET_VERSION,
+        )
+        dummy_pixels = torch.zeros((1, 3, 224, 224), dtype=torch.float32)
+        torch.onnx.export(
+            _VisionTower(model),
+            (dummy_pixels,),
+            str(vision_path),
+            input_names=['pixel_values'],
+            output_names=['image_embeds'],
+            dynamic_axes={
+                'pixel_values': {0: 'batch'},
+                'image_embeds': {0: 'batch'},
+            },
+            opset_version=OPSET_VERSION,
+        )
+
+    def encode(self, inputs, batch_size=64, show_progress_bar=False):
+        """Embed a list of texts or PIL images, L2-normalized."""
+        batches = [
+            inputs[start:start + batch_size]
+            for start in range(0, len(inputs), batch_size)
+        ]
+        if not batches:
+            # Match the torch backend, which returns an empty array
+            # for an empty input list.
+            dim = self.text_session.get_outputs()[0].shape[-1]
+            return np.empty((0, dim), dtype=np.float32)
+        if show_progress_bar:
+            batches = tqdm(batches)
+        outputs = []
+        for batch in batches:
+            if isinstance(batch[0], str):
+                tokens = self.tokenizer(
+                    batch, padding=True, truncation=True, return_tensors='np'
+                )
+                output = self.text_session.run(None, {
+                    'input_ids': tokens['input_ids'].astype(np.int64),
+                    'attention_mask': tokens['attention_mask'].astype(np.int64),
+                })[0]
+            else:
+                pixels = self.image_processor(
+                    batch, return_tensors='np'
+                )['pixel_values']
+                output = self.vision_session.run(
+                    None, {'pixel_values': pixels.astype(np.float32)}
+                )[0]
+            outputs.append(output)
+        embeddings = np.concatenate(outputs)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
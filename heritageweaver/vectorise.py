@@ -0,0 +1,395 @@
+"""Vectorisation of heritage collections with CLIP.
+
+Wraps a catalogue dataframe in a Hugging Face ``Dataset``, embeds the
+text and image modalities with ``clip-ViT-B-32`` and pushes the vectors
+into a ChromaDB collection for cross-collection similarity search.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import chromadb
+import matplotlib.pyplot as plt
+import numpy as np
+import torch
+from datasets import Dataset
+from PIL import Image
+from sentence_transformers import SentenceTransformer
+from tqdm import tqdm
+
+CLIP_MODEL = 'clip-ViT-B-32'
+CLIP_IMAGE_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_IMAGE_STD = (0.26862954, 0.26130258, 0.27577711)
+
+# torch.set_num_interop_threads may only be called once per process;
+# several collections load their model in one run.
+_torch_threads_set = False
+
+# Some catalogue scans are very large; decode them anyway.
+Image.MAX_IMAGE_PIXELS = None
+
+
+def open_image(img_path):
+    """Decode one image from disk, ready for the CLIP image encoder.
+
+    ``draft`` lets libjpeg downscale during decoding: CLIP only needs
+    224x224 input, so there is no point decoding full-size JPEGs.
+    """
+    image = Image.open(img_path)
+    image.draft('RGB', (224, 224))
+    return image.convert('RGB')
+
+
+def chunks(items, size):
+    """Yield successive fixed-size chunks of a list."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def prefetch(iterable, buffer_size=2):
+    """Run an iterable on a background thread with a small buffer.
+
+    While the consumer encodes the current batch, the producer thread
+    is already decoding the next one, so image loading and model
+    inference overlap instead of alternating.
+    """
+    buffer = queue.Queue(maxsize=buffer_size)
+    sentinel = object()
+
+    def _produce():
+        try:
+            for item in iterable:
+                buffer.put(item)
+            buffer.put(sentinel)
+        except BaseException as error:
+            buffer.put(error)
+
+    threading.Thread(target=_produce, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is sentinel:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+class MultiModalCollection:
+    """Base class for a heritage collection with CLIP embeddings.
+
+    Subclasses are expected to populate ``self.df`` with one row per
+    record (or per record/image pair) before calling
+    ``vectorize_collection``.
+    """
+
+    collection_name = 'heritage'
+
+    def __init__(self, db_path='db'):
+        self.df = None
+        self.dataset = None
+        self.clip_model = None
+        self.onnx_encoder = None
+        self._cpu_decode = None
+        self._gpu_preprocess = None
+        if torch.cuda.is_available():
+            self.device = 'cuda'
+        elif torch.backends.mps.is_available():
+            self.device = 'mps'
+        else:
+            self.device = 'cpu'
+        self.client = chromadb.PersistentClient(path=db_path)
+
+    def load_clip_model(self, model_name=CLIP_MODEL, use_onnx=False):
+        """Load the CLIP sentence-transformer used for both modalities.
+
+        With ``use_onnx=True`` the text and vision towers are exported
+        to ONNX and served through onnxruntime instead of PyTorch
+        (requires the optional ``onnxruntime`` dependency).
+        """
+        global _torch_threads_set
+        if self.device == 'cpu' and not _torch_threads_set:
+            # Torch defaults to a conservative thread count; spread the
+            # GEMMs across all cores when CLIP runs on the CPU.
+            torch.set_num_threads(os.cpu_count())
+            torch.set_num_interop_threads(max(1, os.cpu_count() // 4))
+            _torch_threads_set = True
+        self.clip_model = SentenceTransformer(model_name, device=self.device)
+        if self.device == 'cuda':
+            # Half precision doubles matmul throughput on tensor-core
+            # GPUs; the drift in cosine similarities is negligible for
+            # retrieval.
+            self.clip_model.half()
+        if use_onnx:
+            from .onnx_clip import OnnxClipEncoder
+            self.onnx_encoder = OnnxClipEncoder(self.clip_model)
+
+    def encode(self, inputs, batch_size=64, show_progress_bar=False):
+        """Run ``clip_model.encode`` without autograd, in FP16 on CUDA."""
+        if self.onnx_encoder is not None:
+            return self.onnx_encoder.encode(
+                inputs,
+                batch_size=batch_size,
+                show_progress_bar=show_progress_bar,
+            )
+        with torch.inference_mode():
+            if self.device == 'cuda':
+                with torch.autocast(device_type='cuda', dtype=torch.float16):
+                    embeddings = self.clip_model.encode(
+                        inputs,
+                        batch_size=batch_size,
+                        show_progress_bar=show_progress_bar,
+                        convert_to_numpy=True,
+                        normalize_embeddings=True,
+                    )
+            else:
+                embeddings = self.clip_model.encode(
+                    inputs,
+                    batch_size=batch_size,
+                    show_progress_bar=show_progress_bar,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                )
+        return embeddings
+
+    def filter_records(self, modality='text', target_col='description',
+                       num_proc=None):
+        """Drop records that cannot be embedded for the given modality."""
+        if num_proc is None:
+            num_proc = max(1, os.cpu_count() // 2)
+        if modality == 'text':
+            self.dataset = self.dataset.filter(
+                lambda batch: [
+                    t is not None and t.strip() != ''
+                    for t in batch[target_col]
+                ],
+                batched=True,
+                batch_size=1024,
+                num_proc=num_proc,
+            )
+        elif modality == 'image':
+            self.dataset = self.dataset.filter(
+                lambda batch: batch['downloaded'],
+                batched=True,
+                batch_size=1024,
+                num_proc=num_proc,
+            )
+        else:
+            raise ValueError(f"unknown modality '{modality}'")
+        self.df = self.dataset.to_pandas()
+
+    def _load_image_batch(self, batch_paths):
+        """Decode one image batch into a pinned uint8 CHW tensor.
+
+        JPEGs are decoded with torchvision's read_image, resized and
+        cropped as uint8 tensors on the CPU, then stacked and pinned so
+        the upload to the GPU can run as one non-blocking transfer.
+        """
+        from torchvision.io import ImageReadMode, read_image
+        from torchvision.transforms import v2
+        from torchvision.transforms.functional import InterpolationMode
+        if self._cpu_decode is None:
+            # Bicubic to match the HF CLIPImageProcessor used on the
+            # CPU/MPS/ONNX paths, so embeddings stay comparable.
+            self._cpu_decode = v2.Compose([
+                v2.Resize(
+                    224,
+                    interpolation=InterpolationMode.BICUBIC,
+                    antialias=True,
+                ),
+                v2.CenterCrop(224),
+            ])
+        return torch.stack([
+            self._cpu_decode(read_image(img_path, mode=ImageReadMode.RGB))
+            for img_path in batch_paths
+        ]).pin_memory()
+
+    def _encode_image_batch_gpu(self, batch):
+        """Encode one pinned image batch on the GPU.
+
+        Dtype conversion to FP16 and CLIP normalisation run as batched
+        GPU ops and the batch is fed straight to the CLIP vision tower,
+        bypassing the per-image PIL path inside sentence-transformers.
+        """
+        from torchvision.transforms import v2
+        if self._gpu_preprocess is None:
+            self._gpu_preprocess = v2.Compose([
+                v2.ConvertImageDtype(torch.float16),
+                v2.Normalize(CLIP_IMAGE_MEAN, CLIP_IMAGE_STD),
+            ])
+        with torch.inference_mode():
+            pixel_values = self._gpu_preprocess(
+                batch.to(self.device, non_blocking=True)
+            )
+            features = (
+                self.clip_model._first_module()
+                .model.get_image_features(pixel_values=pixel_values)
+            )
+            features = torch.nn.functional.normalize(features, dim=-1)
+        return features.float().cpu().numpy()
+
+    def _iter_image_batches(self, img_paths, batch_size):
+        """Yield batches of decoded PIL images from a list of paths."""
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for batch_paths in chunks(img_paths, batch_size):
+                yield list(executor.map(open_image, batch_paths))
+
+    def embed_clip(self, modality='text', target_col='description',
+                   batch_size=64):
+        """Embed one modality of the collection with CLIP.
+
+        The whole column is handed to ``clip_model.encode`` in one call
+        so sentence-transformers can run properly batched forward
+        passes instead of encoding one record at a time.
+        """
+        if self.clip_model is None:
+            self.load_clip_model()
+        if modality == 'text':
+            texts = [t.lower() for t in self.dataset[target_col]]
+            # Encode in length-sorted order so batches hold similarly
+            # sized descriptions and short ones are not padded to the
+            # longest text in the collection, then scatter the vectors
+            # back to the original record order.
+            order = np.argsort([len(t) for t in texts])
+            sorted_embeddings = self.encode(
+                [texts[i] for i in order],
+                batch_size=batch_size,
+                show_progress_bar=True,
+            )
+            embeddings = np.empty_like(sorted_embeddings)
+            embeddings[order] = sorted_embeddings
+        elif modality == 'image':
+            # The dataset only ever holds image paths; decoded PIL
+            # images live for one batch at a time and never pass
+            # through the Arrow serializer.
+            img_paths = self.dataset['img_path']
+            n_batches = (len(img_paths) + batch_size - 1) // batch_size
+            if not img_paths:
+                # Nothing survived the image filter (e.g. no images
+                # fetched yet); add an empty column rather than asking
+                # np.concatenate for at least one array.
+                embeddings = np.empty((0, 0), dtype=np.float32)
+            elif self.device == 'cuda' and self.onnx_encoder is None:
+                batches = (
+                    self._load_image_batch(batch_paths)
+                    for batch_paths in chunks(img_paths, batch_size)
+                )
+                embeddings = np.concatenate([
+                    self._encode_image_batch_gpu(batch)
+                    for batch in tqdm(prefetch(batches), total=n_batches)
+                ])
+            else:
+                embeddings = np.concatenate([
+                    self.encode(images, batch_size=batch_size)
+                    for images in tqdm(
+                        prefetch(self._iter_image_batches(
+                            img_paths, batch_size
+                        )),
+                        total=n_batches,
+                    )
+                ])
+        else:
+            raise ValueError(f"unknown modality '{modality}'")
+        self.dataset = self.dataset.add_column(
+            f'clip_{modality}_embedding', list(embeddings)
+        )
+
+    def add_embeddings_to_database(self, modality='text'):
+        """Push the embeddings for one modality to ChromaDB."""
+        if len(self.df) == 0:
+            # chromadb rejects empty ids/embeddings; nothing to index
+            # (e.g. no images fetched yet).
+            return
+        collection = self.client.get_or_create_collection(
+            self.collection_name, metadata={'hnsw:space': 'cosine'}
+        )
+        img_paths = self.df['img_path'].tolist()
+        record_ids = self.df['record_id'].tolist()
+        metadatas = [
+            {
+                'collection': self.collection_name,
+                'modality': modality,
+                'img_path': img_path,
+                'record_id': record_id,
+            }
+            for img_path, record_id in zip(img_paths, record_ids)
+        ]
+        ids = [
+            f'{record_id}_{modality}_{i}'
+            for i, record_id in enumerate(record_ids)
+        ]
+        # chromadb accepts ndarrays directly; reading the column through
+        # the numpy format avoids boxing every float into a Python list.
+        embeddings = np.ascontiguousarray(
+            self.dataset.with_format('numpy')[f'clip_{modality}_embedding']
+        )
+        collection.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+
+    def save_embeddings(self, modality='text', out_path=None):
+        """Cache one modality's embeddings as a float32 memmap on disk.
+
+        Repeat runs can memory-map the cached matrix and score a query
+        against the whole collection with a single matrix product.
+        """
+        if out_path is None:
+            out_path = f'{self.collection_name}_clip_{modality}_embedding.dat'
+        arr = np.ascontiguousarray(
+            self.dataset.with_format('numpy')[f'clip_{modality}_embedding'],
+            dtype=np.float32,
+        )
+        arr /= np.linalg.norm(arr, axis=1, keepdims=True)
+        mm = np.memmap(out_path, dtype='float32', mode='w+', shape=arr.shape)
+        mm[:] = arr
+        mm.flush()
+        return mm
+
+    @staticmethod
+    def load_embeddings(path, dim=512):
+        """Memory-map an embedding matrix written by ``save_embeddings``."""
+        n_rows = os.path.getsize(path) // (4 * dim)
+        return np.memmap(path, dtype='float32', mode='r', shape=(n_rows, dim))
+
+    def similarity_search(self, query, embeddings, top_k=9):
+        """Indices of the records closest to a free-text query.
+
+        One matrix-vector product against the normalized embedding
+        matrix scores the whole collection at once.
+        """
+        if self.clip_model is None:
+            self.load_clip_model()
+        query_embedding = self.encode([query.lower()])[0]
+        sims = embeddings @ query_embedding
+        if top_k >= len(sims):
+            # argpartition needs top_k < len(sims); small collections
+            # just get a full ranking.
+            return np.argsort(-sims)
+        top = np.argpartition(-sims, top_k)[:top_k]
+        return top[np.argsort(-sims[top])]
+
+    def vectorize_collection(self, modalities=('text', 'image')):
+        """Embed and index every requested modality of the collection."""
+        for modality in modalities:
+            self.dataset = Dataset.from_pandas(self.df, preserve_index=False)
+            self.filter_records(modality)
+            self.embed_clip(modality)
+            self.add_embeddings_to_database(modality)
+
+    def plot_images(self, query, n_results=9):
+        """Plot the images closest to a free-text query."""
+        if self.clip_model is None:
+            self.load_clip_model()
+        collection = self.client.get_collection(self.collection_name)
+        query_embedding = self.encode([query.lower()])[0]
+        results = collection.query(
+            query_embeddings=[query_embedding.tolist()],
+            n_results=n_results,
+            where={'modality': 'image'},
+        )
+        img_paths = [m['img_path'] for m in results['metadatas'][0]]
+        fig, axes = plt.subplots(3, 3, figsize=(12, 12))
+        for ax, img_path in zip(axes.flat, img_paths):
+            ax.imshow(Image.open(img_path))
+            ax.axis('off')
+        plt.tight_layout()
+        plt.show()